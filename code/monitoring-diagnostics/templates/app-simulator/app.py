@@ -5,12 +5,27 @@ GitHub: https://github.com/DevOpsBestPracticesTelegramCanal/DevOpsBestPractices
 Telegram: @DevOps_best_practices
 """
 
+import os
+import json
+import math
+import queue
+import atexit
+import bisect
+import itertools
 import time
 import random
+import re
+import socket
 import threading
-from flask import Flask, request, jsonify
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from flask import Flask, request, jsonify, g
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
 import logging
+import logging.handlers
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -25,12 +40,731 @@ REQUEST_COUNT = Counter(
     ['method', 'endpoint', 'code']
 )
 
-REQUEST_DURATION = Histogram(
-    'http_request_duration_seconds',
-    'HTTP request duration in seconds',
-    ['method', 'endpoint']
+# Раскладки бакетов http_request_duration_seconds (HISTOGRAM_MODE):
+#   default - бакеты prometheus_client по умолчанию, общие для всех endpoint'ов
+#   tuned   - свои бакеты на endpoint (ENDPOINT_BUCKETS / HISTOGRAM_BUCKETS)
+#   exponential - сетка native histograms: границы 2^(k * 2^-schema) на
+#             диапазоне endpoint'а (min..max его бакетов). Ширина бакета,
+#             а с ней и ошибка квантиля внутри диапазона, не больше base - 1
+#             (schema 2: 19%, 3: 9%); HISTOGRAM_MAX_BUCKETS ограничивает
+#             число границ, понижая schema для широких диапазонов. Серий
+#             больше, чем в default - это цена ограниченной ошибки
+# В tuned и exponential набор le у endpoint'ов разный и фиксирован с момента
+# создания серии, поэтому квантили считаются "sum by (le, endpoint)":
+# "sum by (le)" смешал бы разные сетки. Golden Signals дашборд и алерты
+# агрегируют именно так
+ENDPOINT_BUCKETS = {
+    '/': [0.01, 0.02, 0.03, 0.04, 0.05, 0.075, 0.1, 0.25, 1.0],
+    '/health': [0.001, 0.0025, 0.005, 0.0075, 0.01, 0.025, 0.1],
+    '/api/users': [0.05, 0.075, 0.1, 0.125, 0.15, 0.2, 0.3, 0.5, 1.0],
+    '/api/orders': [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 1.0, 2.5, 5.0],
+    '/api/products': [0.03, 0.05, 0.075, 0.1, 0.125, 0.15, 0.25, 0.5, 1.0],
+    '*': list(Histogram.DEFAULT_BUCKETS[:-1]),
+}
+
+
+class FixedLayout:
+    """Явно заданные границы бакетов (+Inf добавляется при экспозиции)"""
+
+    def __init__(self, bounds):
+        # Сначала float(): "+Inf" из HISTOGRAM_BUCKETS - строка, а не float('inf')
+        self.bounds = sorted(b for b in map(float, bounds) if b != float('inf'))
+        self.labels = [floatToGoString(b) for b in self.bounds] + ['+Inf']
+
+    def index(self, value):
+        return bisect.bisect_left(self.bounds, value)
+
+
+class ExponentialLayout(FixedLayout):
+    """Границы экспоненциальной сетки native histograms, покрывающие [low, high].
+
+    base = 2^(2^-schema), границы base^k. schema понижается (как при
+    переполнении native histogram), пока границ больше max_buckets.
+    Внутри [low, high] относительная ошибка квантиля не больше
+    relative_error = base - 1; ниже low и выше high она не ограничена.
+    """
+
+    MIN_SCHEMA = -4
+
+    def __init__(self, low, high, schema=2, max_buckets=48):
+        if not 0 < low < high:
+            raise ValueError(f"exponential range must satisfy 0 < low < high, got {low}..{high}")
+        if max_buckets < 2:
+            raise ValueError(f"max_buckets must be at least 2, got {max_buckets}")
+        for schema in range(schema, self.MIN_SCHEMA - 1, -1):
+            factor = 2.0 ** schema
+            first = math.floor(math.log2(low) * factor + 1e-9)
+            last = math.ceil(math.log2(high) * factor - 1e-9)
+            if last - first + 1 <= max_buckets:
+                break
+        self.schema = schema
+        self.relative_error = 2.0 ** (2.0 ** -schema) - 1
+        super().__init__(float(f'{2.0 ** (k / factor):.6g}') for k in range(first, last + 1))
+
+
+class _HistogramChild:
+    def __init__(self, layout):
+        self.layout = layout
+        self.counts = [0] * (len(layout.bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = self.layout.index(value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class LayoutHistogram:
+    """Histogram с раскладкой бакетов, выбираемой по лейблам серии.
+
+    Совместим с вызовами REQUEST_DURATION.labels(...).observe(...), а в
+    экспозиции выглядит как обычная классическая гистограмма.
+    """
+
+    def __init__(self, name, documentation, labelnames, layout_for, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.layout_for = layout_for
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values, **kwargs):
+        # Те же проверки, что и у MetricWrapperBase.labels() в prometheus_client
+        if values and kwargs:
+            raise ValueError("Can't pass both *args and **kwargs")
+        if kwargs:
+            if sorted(kwargs) != sorted(self.labelnames):
+                raise ValueError('Incorrect label names')
+            values = tuple(kwargs[name] for name in self.labelnames)
+        elif len(values) != len(self.labelnames):
+            raise ValueError('Incorrect label count')
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = _HistogramChild(self.layout_for(dict(zip(self.labelnames, key))))
+                    self._children[key] = child
+        return child
+
+    def describe(self):
+        return [HistogramMetricFamily(self.name, self.documentation, labels=self.labelnames)]
+
+    def collect(self):
+        family = HistogramMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for key, child in list(self._children.items()):
+            counts, total_sum = child.snapshot()
+            buckets = list(zip(child.layout.labels, itertools.accumulate(counts)))
+            family.add_metric(list(key), buckets, total_sum)
+        yield family
+
+
+def make_request_duration(mode=None, registry=REGISTRY):
+    """http_request_duration_seconds в раскладке mode (по умолчанию HISTOGRAM_MODE)"""
+    mode = mode or os.environ.get('HISTOGRAM_MODE', 'default')
+    if mode == 'default':
+        return Histogram(
+            'http_request_duration_seconds',
+            'HTTP request duration in seconds',
+            ['method', 'endpoint'],
+            registry=registry
+        )
+    bounds = dict(ENDPOINT_BUCKETS)
+    bounds.update(json.loads(os.environ.get('HISTOGRAM_BUCKETS', '{}')))
+    if mode == 'tuned':
+        layouts = {endpoint: FixedLayout(b) for endpoint, b in bounds.items()}
+    elif mode == 'exponential':
+        schema = int(os.environ.get('HISTOGRAM_SCHEMA', '2'))
+        max_buckets = int(os.environ.get('HISTOGRAM_MAX_BUCKETS', '48'))
+        layouts = {endpoint: ExponentialLayout(min(b), max(b), schema, max_buckets)
+                   for endpoint, b in bounds.items()}
+        logger.info("Exponential buckets: " + ', '.join(
+            f"{endpoint} schema {l.schema} ({len(l.bounds)} bounds, <= {l.relative_error:.0%})"
+            for endpoint, l in layouts.items()))
+    else:
+        raise ValueError(f"Unknown HISTOGRAM_MODE: {mode}")
+    return LayoutHistogram(
+        'http_request_duration_seconds',
+        'HTTP request duration in seconds',
+        ['method', 'endpoint'],
+        lambda labels: layouts.get(labels['endpoint'], layouts['*']),
+        registry=registry
+    )
+
+
+REQUEST_DURATION = make_request_duration()
+
+# Синтетические high-cardinality серии для нагрузочного тестирования стека
+class SyntheticSeriesCollector:
+    """Отдает N синтетических серий, значения вычисляются только во время scrape.
+
+    Настройка через переменные окружения:
+      SYNTHETIC_SERIES  - число активных серий (0 - режим выключен)
+      SYNTHETIC_LABELS  - fan-out лейблов, например "region:5,service:40,pod"
+                          (последний лейбл без кардинальности получает остаток
+                          индекса и растет вместе с churn)
+      SYNTHETIC_CHURN   - сколько серий в секунду исчезает и появляется взамен
+      SYNTHETIC_PATTERN - constant | counter | sine | random
+
+    Серия с индексом i существует, пока i в окне [offset, offset + N), где
+    offset = churn * uptime. Сами серии рендерятся сразу в текст экспозиции
+    (render(), дописывается к generate_latest() в /metrics): префикс
+    "имя{лейблы} " кэшируется на серию, и на scrape не создаются объекты
+    Metric/Sample. Через REGISTRY (collect()) отдаются только служебные
+    метрики synthetic_series_*.
+    """
+
+    PATTERNS = ('constant', 'counter', 'sine', 'random')
+    LABEL_NAME = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
+
+    def __init__(self, series, labels='region:5,service:20,pod', churn=0.0, pattern='sine'):
+        if pattern not in self.PATTERNS:
+            raise ValueError(f"Unknown SYNTHETIC_PATTERN: {pattern}")
+        self.series = series
+        self.churn = churn
+        self.pattern = pattern
+        self.label_names, self.fanout = [], []
+        for item in labels.split(','):
+            name, _, cardinality = item.strip().partition(':')
+            if not self.LABEL_NAME.match(name) or name.startswith('__'):
+                raise ValueError(f"Invalid SYNTHETIC_LABELS label name: {name!r}")
+            if name in self.label_names:
+                # Повтор лейбла - невалидная экспозиция, Prometheus отбросит весь scrape
+                raise ValueError(f"Duplicate SYNTHETIC_LABELS label name: {name!r}")
+            self.label_names.append(name)
+            self.fanout.append(int(cardinality) if cardinality else 0)
+        self.fanout[-1] = 0  # последний лейбл всегда неограничен
+        # Имена и заголовки как у generate_latest() для Counter/GaugeMetricFamily
+        if pattern == 'counter':
+            self.sample, kind = 'synthetic_series_total', 'counter'
+        else:
+            self.sample, kind = 'synthetic_series_value', 'gauge'
+        self._header = (f"# HELP {self.sample} Synthetic high-cardinality series\n"
+                        f"# TYPE {self.sample} {kind}\n")
+        self.started = time.time()
+        self._prefix_cache = {}
+        self._cache_offset = 0
+        self._offset = 0
+        self._render_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        series = int(os.environ.get('SYNTHETIC_SERIES', '0'))
+        if series <= 0:
+            return None
+        return cls(
+            series,
+            labels=os.environ.get('SYNTHETIC_LABELS', 'region:5,service:20,pod'),
+            churn=float(os.environ.get('SYNTHETIC_CHURN', '0')),
+            pattern=os.environ.get('SYNTHETIC_PATTERN', 'sine'),
+        )
+
+    def _labels(self, index):
+        """Mixed-radix разложение индекса серии в значения лейблов"""
+        values = []
+        rest = index
+        for name, cardinality in zip(self.label_names, self.fanout):
+            if cardinality:
+                values.append(f"{name}-{rest % cardinality}")
+                rest //= cardinality
+            else:
+                values.append(f"{name}-{rest}")
+        return values
+
+    def _prefix(self, index):
+        # Значения лейблов - "<имя лейбла>-<число>", экранирование не нужно;
+        # лейблы в алфавитном порядке, как у generate_latest()
+        pairs = ','.join(f'{name}="{value}"'
+                         for name, value in sorted(zip(self.label_names, self._labels(index))))
+        return f'{self.sample}{{{pairs}}} '
+
+    def _values(self, window, uptime):
+        if self.pattern == 'constant':
+            return [float(index % 1000) for index in window]
+        if self.pattern == 'counter':
+            return [float(int(uptime * (1 + index % 10))) for index in window]
+        if self.pattern == 'sine':
+            sin, phase = math.sin, uptime / 60.0
+            return [50.0 + 50.0 * sin(phase + index) for index in window]
+        rand = random.random
+        return [rand() * 100.0 for _ in window]
+
+    def render(self):
+        """Текст экспозиции (format 0.0.4) для активного окна серий"""
+        started = time.perf_counter()
+        uptime = time.time() - self.started
+        offset = int(uptime * self.churn)
+        window = range(offset, offset + self.series)
+
+        with self._lock:
+            cache = self._prefix_cache
+            # Серии, ушедшие из окна, больше не нужны
+            for index in range(self._cache_offset, min(offset, self._cache_offset + self.series)):
+                cache.pop(index, None)
+            self._cache_offset = offset
+            prefixes = []
+            for index in window:
+                prefix = cache.get(index)
+                if prefix is None:
+                    prefix = cache[index] = self._prefix(index)
+                prefixes.append(prefix)
+        # repr(float) совпадает с floatToGoString только для значений < 1e6
+        # (constant, sine, random); counter растет без границы, и для него
+        # нужен floatToGoString: 1234567.0 -> "1.234567e+06"
+        fmt = floatToGoString if self.pattern == 'counter' else repr
+        lines = [f'{prefix}{fmt(value)}\n'
+                 for prefix, value in zip(prefixes, self._values(window, uptime))]
+        text = (self._header + ''.join(lines)).encode('utf-8')
+        self._offset = offset
+        self._render_seconds = time.perf_counter() - started
+        return text
+
+    def describe(self):
+        # Без describe() REGISTRY.register() вызвал бы полный collect()
+        return []
+
+    def collect(self):
+        yield GaugeMetricFamily('synthetic_series_active', 'Number of active synthetic series',
+                                value=self.series)
+        yield CounterMetricFamily('synthetic_series_created', 'Synthetic series created since start',
+                                  value=self._offset + self.series)
+        yield GaugeMetricFamily('synthetic_series_collect_seconds',
+                                'Time spent rendering synthetic series on the last scrape',
+                                value=self._render_seconds)
+
+
+SYNTHETIC = SyntheticSeriesCollector.from_env()
+if SYNTHETIC is not None:
+    REGISTRY.register(SYNTHETIC)
+
+
+# Профили задержек и ошибок по endpoint'ам (значения по умолчанию повторяют
+# прежнее поведение приложения). Меняются на лету через /admin/faults.
+DEFAULT_PROFILES = {
+    '/': {
+        'latency': {'type': 'uniform', 'low': 0.01, 'high': 0.05},
+        'errors': {'rate': 0.0, 'code': 500},
+    },
+    '/health': {
+        'latency': {'type': 'uniform', 'low': 0.001, 'high': 0.01},
+        'errors': {'rate': 0.0, 'code': 500},
+    },
+    '/api/users': {
+        'latency': {'type': 'uniform', 'low': 0.05, 'high': 0.15},
+        'errors': {'rate': 0.05, 'code': 500},
+    },
+    '/api/orders': {
+        'latency': {'type': 'uniform', 'low': 0.2, 'high': 0.8},
+        'errors': {'rate': 0.1, 'code': 500},
+    },
+    '/api/products': {
+        'latency': {'type': 'uniform', 'low': 0.03, 'high': 0.12},
+        'errors': {'rate': 0.08, 'code': 400},
+    },
+}
+
+MAX_LATENCY = 30.0  # верхняя граница любой задержки, секунды
+
+DISTRIBUTION_PARAMS = {
+    'constant': ('value',),
+    'uniform': ('low', 'high'),
+    'lognormal': ('median', 'sigma'),
+    'pareto': ('scale', 'alpha'),
+    'mixture': ('components',),
+}
+
+
+def require_number(value, name, low=None, high=None, positive=False):
+    """Проверяет, что value - число в допустимых границах, бросает ValueError"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or math.isnan(value):
+        raise ValueError(f"{name} must be a number")
+    if positive and value <= 0:
+        raise ValueError(f"{name} must be positive")
+    if low is not None and value < low:
+        raise ValueError(f"{name} must be >= {low}")
+    if high is not None and value > high:
+        raise ValueError(f"{name} must be <= {high}")
+    return value
+
+
+def require_status_code(value, name):
+    if isinstance(value, bool) or not isinstance(value, int) or not 100 <= value <= 599:
+        raise ValueError(f"{name} must be an HTTP status code (100-599)")
+    return value
+
+
+def validate_distribution(spec):
+    """Проверяет описание распределения задержки, бросает ValueError"""
+    if not isinstance(spec, dict) or spec.get('type') not in DISTRIBUTION_PARAMS:
+        raise ValueError(f"latency type must be one of {sorted(DISTRIBUTION_PARAMS)}")
+    kind = spec['type']
+    for param in DISTRIBUTION_PARAMS[kind]:
+        if param not in spec:
+            raise ValueError(f"{kind} distribution requires '{param}'")
+    if kind == 'constant':
+        require_number(spec['value'], 'constant value', positive=True)
+    elif kind == 'uniform':
+        require_number(spec['low'], 'uniform low', low=0)
+        require_number(spec['high'], 'uniform high', low=spec['low'])
+    elif kind == 'lognormal':
+        require_number(spec['median'], 'lognormal median', positive=True)
+        require_number(spec['sigma'], 'lognormal sigma', low=0)
+    elif kind == 'pareto':
+        require_number(spec['scale'], 'pareto scale', positive=True)
+        require_number(spec['alpha'], 'pareto alpha', positive=True)
+    else:
+        if not isinstance(spec['components'], list) or not spec['components']:
+            raise ValueError("mixture requires at least one component")
+        for component in spec['components']:
+            if not isinstance(component, dict):
+                raise ValueError("mixture components must be objects")
+            require_number(component.get('weight', 1), 'mixture component weight', positive=True)
+            validate_distribution(component)
+    if 'max' in spec:
+        require_number(spec['max'], f"{kind} max", low=0)
+
+
+def validate_errors(spec):
+    """Проверяет описание ошибок endpoint'а, бросает ValueError"""
+    if not isinstance(spec, dict):
+        raise ValueError("errors must be an object")
+    require_number(spec.get('rate', 0), 'errors.rate', low=0, high=1)
+    require_status_code(spec.get('code', 500), 'errors.code')
+    burst = spec.get('burst')
+    if burst is not None:
+        if not isinstance(burst, dict):
+            raise ValueError("errors.burst must be an object")
+        for param in ('enter', 'exit', 'rate'):
+            if param not in burst:
+                raise ValueError(f"errors.burst requires '{param}'")
+            require_number(burst[param], f"errors.burst.{param}", low=0, high=1)
+
+
+def validate_window(window):
+    """Проверяет окно деградации, бросает ValueError"""
+    if not isinstance(window, dict):
+        raise ValueError("window must be an object")
+    if not isinstance(window.get('endpoint', '*'), str):
+        raise ValueError("window endpoint must be a string")
+    require_number(window.get('duration'), 'window duration', positive=True)
+    require_number(window.get('start_in', 0), 'window start_in', low=0)
+    require_number(window.get('latency_multiplier', 1.0), 'window latency_multiplier', low=0)
+    require_number(window.get('latency_add', 0.0), 'window latency_add', low=0)
+    require_number(window.get('error_rate', 0.0), 'window error_rate', low=0, high=1)
+    require_status_code(window.get('error_code', 503), 'window error_code')
+
+
+def sample_latency(spec):
+    """Случайная задержка в секундах по описанию распределения"""
+    kind = spec['type']
+    if kind == 'constant':
+        value = spec['value']
+    elif kind == 'uniform':
+        value = random.uniform(spec['low'], spec['high'])
+    elif kind == 'lognormal':
+        value = random.lognormvariate(math.log(spec['median']), spec['sigma'])
+    elif kind == 'pareto':
+        value = spec['scale'] * random.paretovariate(spec['alpha'])
+    else:
+        components = spec['components']
+        component = random.choices(components, weights=[c.get('weight', 1) for c in components])[0]
+        value = sample_latency(component)
+    return min(max(value, 0.0), spec.get('max', MAX_LATENCY))
+
+
+class FaultInjector:
+    """Профили задержек/ошибок и окна деградации, изменяемые во время работы.
+
+    Ошибки могут идти пачками: при наличии errors.burst endpoint переходит в
+    состояние "burst" с вероятностью enter на запрос и выходит из него с
+    вероятностью exit; в этом состоянии доля ошибок равна burst.rate.
+
+    Окно деградации: {"endpoint": "/api/orders" | "*", "start_in": 0,
+    "duration": 60, "latency_multiplier": 3, "latency_add": 0.2,
+    "error_rate": 0.3, "error_code": 503}.
+    """
+
+    def __init__(self, profiles):
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._windows = []
+        self._in_burst = {}
+        self.update_profiles(profiles)
+
+    def update_profiles(self, profiles):
+        """Частичное обновление: заменяются только переданные endpoint'ы/поля"""
+        with self._lock:
+            merged = dict(self._profiles)
+            if not isinstance(profiles, dict):
+                raise ValueError("profiles must be an object")
+            for endpoint, profile in profiles.items():
+                if not isinstance(profile, dict):
+                    raise ValueError(f"{endpoint}: profile must be an object")
+                current = dict(merged.get(endpoint, {'errors': {'rate': 0.0, 'code': 500}}))
+                current.update(profile)
+                if 'latency' not in current:
+                    raise ValueError(f"{endpoint}: latency distribution is required")
+                validate_distribution(current['latency'])
+                validate_errors(current['errors'])
+                merged[endpoint] = current
+            self._profiles = merged
+
+    def add_window(self, window):
+        validate_window(window)
+        start = time.time() + window.get('start_in', 0)
+        entry = dict(window, start=start, end=start + window['duration'])
+        with self._lock:
+            self._windows = [w for w in self._windows if w['end'] > time.time()] + [entry]
+        return entry
+
+    def clear_windows(self):
+        with self._lock:
+            self._windows = []
+
+    def config(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'profiles': self._profiles,
+                'windows': [dict(w, active=w['start'] <= now < w['end'])
+                            for w in self._windows if w['end'] > now],
+            }
+
+    def sample(self, endpoint):
+        """Возвращает (задержка в секундах, HTTP код) для очередного запроса"""
+        now = time.time()
+        with self._lock:
+            profile = self._profiles.get(endpoint)
+            windows = [w for w in self._windows
+                       if w['start'] <= now < w['end'] and w.get('endpoint', '*') in ('*', endpoint)]
+            if profile is None:
+                return 0.0, 200
+            errors = profile['errors']
+            error_rate, error_code = errors.get('rate', 0.0), errors.get('code', 500)
+            burst = errors.get('burst')
+            if burst:
+                in_burst = self._in_burst.get(endpoint, False)
+                in_burst = random.random() >= burst['exit'] if in_burst else random.random() < burst['enter']
+                self._in_burst[endpoint] = in_burst
+                if in_burst:
+                    error_rate = burst['rate']
+
+        duration = sample_latency(profile['latency'])
+        for window in windows:
+            duration = duration * window.get('latency_multiplier', 1.0) + window.get('latency_add', 0.0)
+            if window.get('error_rate', 0.0) > error_rate:
+                error_rate, error_code = window['error_rate'], window.get('error_code', 503)
+        status_code = error_code if random.random() < error_rate else 200
+        return min(duration, MAX_LATENCY), status_code
+
+
+def load_fault_config():
+    """Начальные профили: DEFAULT_PROFILES + FAULT_CONFIG (если задан).
+
+    FAULT_CONFIG - JSON строкой ({"profiles": ..., "windows": [...]}) или
+    путь к JSON файлу внутри контейнера.
+    """
+    injector = FaultInjector(DEFAULT_PROFILES)
+    value = os.environ.get('FAULT_CONFIG', '').strip()
+    if value:
+        if value.startswith('{'):
+            config = json.loads(value)
+        else:
+            with open(value) as f:
+                config = json.load(f)
+        injector.update_profiles(config.get('profiles', {}))
+        for window in config.get('windows', []):
+            injector.add_window(window)
+    return injector
+
+
+FAULTS = load_fault_config()
+
+
+def record_request(method, endpoint, status_code, duration):
+    """Запись метрик одного запроса (handlers и фоновый трафик)"""
+    REQUEST_COUNT.labels(method=method, endpoint=endpoint, code=status_code).inc()
+    REQUEST_DURATION.labels(method=method, endpoint=endpoint).observe(duration)
+
+
+def simulate_request(method, endpoint):
+    """Задержка и код ответа по текущему профилю + запись метрик"""
+    duration, status_code = FAULTS.sample(endpoint)
+    time.sleep(duration)
+    record_request(method, endpoint, status_code, duration)
+    return status_code
+
+
+# Структурированный access log: запись в bounded очередь на потоке запроса,
+# форматирование и батчевая отправка в Loki - в отдельном потоке
+ACCESS_LOG_DROPPED = Counter(
+    'access_log_dropped_total',
+    'Access log entries dropped before reaching Loki',
+    ['reason']
+)
+
+ACCESS_LOG_PUSHED = Counter(
+    'access_log_pushed_total',
+    'Access log entries pushed to Loki'
 )
 
+LOKI_PUSH_DURATION = Histogram(
+    'loki_push_duration_seconds',
+    'Duration of Loki push API calls in seconds'
+)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполнении очереди отбрасывает запись"""
+
+    def prepare(self, record):
+        # Форматирование переносится в поток отправки
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            ACCESS_LOG_DROPPED.labels(reason='queue_full').inc()
+
+
+class LokiShipper:
+    """Забирает записи из очереди и отправляет их в Loki push API батчами.
+
+    Батч уходит, когда набрано batch_size записей или первая запись ждет
+    дольше batch_wait секунд. Без LOKI_URL записи печатаются в stdout как
+    JSON-строки (видны в docker logs); promtail из application/templates
+    читает только файлы и разбирает их regex'ом, поэтому для сбора stdout
+    ему нужен отдельный scrape config для логов Docker (docker_sd_configs
+    и стадия json). Неудачный push повторяется
+    max_retries раз, после чего батч отбрасывается и учитывается в
+    access_log_dropped_total{reason="push_failed"}.
+    """
+
+    def __init__(self, log_queue, url=None, labels=None, batch_size=500, batch_wait=1.0,
+                 timeout=5.0, max_retries=2):
+        self.queue = log_queue
+        self.url = url
+        self.labels = labels or {}
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='loki-shipper', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        batch, deadline = [], None
+        while not (self._stop.is_set() and self.queue.empty()):
+            wait = self.batch_wait if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                record = self.queue.get(timeout=min(wait, 0.5))
+                if deadline is None:
+                    deadline = time.monotonic() + self.batch_wait
+                batch.append(record)
+            except queue.Empty:
+                pass
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline
+                          or self._stop.is_set()):
+                self._flush(batch)
+                batch, deadline = [], None
+        if batch:
+            self._flush(batch)
+
+    @staticmethod
+    def format(record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'access', {}))
+        return json.dumps(entry, separators=(',', ':'))
+
+    def _flush(self, batch):
+        if not self.url:
+            for record in batch:
+                print(self.format(record), flush=True)
+            return
+
+        streams = {}
+        for record in batch:
+            key = record.levelname.lower()
+            streams.setdefault(key, []).append([str(int(record.created * 1e9)), self.format(record)])
+        payload = json.dumps({'streams': [
+            {'stream': dict(self.labels, level=level), 'values': values}
+            for level, values in streams.items()
+        ]}).encode()
+
+        for attempt in range(self.max_retries + 1):
+            req = urllib.request.Request(self.url, data=payload, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+            try:
+                with LOKI_PUSH_DURATION.time():
+                    with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                        response.read()
+                ACCESS_LOG_PUSHED.inc(len(batch))
+                return
+            except urllib.error.HTTPError as e:
+                if 400 <= e.code < 500 and e.code != 429:
+                    break  # Loki отверг батч, повтор не поможет
+            except (urllib.error.URLError, OSError):
+                pass
+            if self._stop.wait(min(0.5 * 2 ** attempt, 5.0)):
+                break
+        ACCESS_LOG_DROPPED.labels(reason='push_failed').inc(len(batch))
+
+
+def setup_access_log():
+    """Логгер access log, не блокирующий обработку запросов"""
+    log_queue = queue.Queue(maxsize=int(os.environ.get('ACCESS_LOG_QUEUE_SIZE', '10000')))
+    # Та же схема лейблов, что у promtail (application/templates/promtail):
+    # target_app / target_env / target_host, плюс level на каждый stream
+    labels = {'target_app': 'demo-app', 'target_env': 'demo', 'target_host': socket.gethostname()}
+    for item in filter(None, os.environ.get('LOKI_LABELS', '').split(',')):
+        name, _, value = item.partition('=')
+        labels[name.strip()] = value.strip()
+
+    shipper = LokiShipper(
+        log_queue,
+        url=os.environ.get('LOKI_URL') or None,
+        labels=labels,
+        batch_size=int(os.environ.get('LOKI_BATCH_SIZE', '500')),
+        batch_wait=float(os.environ.get('LOKI_BATCH_WAIT', '1.0')),
+    )
+    shipper.start()
+    atexit.register(shipper.stop, 5.0)
+
+    Gauge('access_log_queue_size', 'Access log entries waiting to be shipped').set_function(log_queue.qsize)
+
+    access_log = logging.getLogger('access')
+    access_log.setLevel(logging.INFO)
+    access_log.propagate = False
+    access_log.addHandler(DroppingQueueHandler(log_queue))
+    return access_log, shipper
+
+
+ACCESS_LOG, ACCESS_LOG_SHIPPER = setup_access_log()
+
+
 # Симуляция нагрузки
 def generate_traffic():
     """Генерирует фоновый трафик для реалистичных метрик"""
@@ -41,31 +775,44 @@ def generate_traffic():
         endpoint = random.choice(endpoints)
         method = random.choice(methods)
         
-        # Симуляция времени ответа
-        if endpoint == '/health':
-            duration = random.uniform(0.001, 0.01)  # Быстрый endpoint
-            status_code = 200
-        elif endpoint == '/api/orders':
-            duration = random.uniform(0.1, 0.5)  # Медленный endpoint
-            # Иногда генерируем ошибки
-            status_code = random.choices([200, 500], weights=[95, 5])[0]
-        else:
-            duration = random.uniform(0.01, 0.2)  # Обычные endpoints
-            status_code = random.choices([200, 400, 500], weights=[90, 8, 2])[0]
-        
-        # Записываем метрики
-        REQUEST_COUNT.labels(method=method, endpoint=endpoint, code=status_code).inc()
-        REQUEST_DURATION.labels(method=method, endpoint=endpoint).observe(duration)
+        try:
+            # Время ответа и ошибки берутся из тех же профилей, что и у handlers
+            duration, status_code = FAULTS.sample(endpoint)
+            
+            # Записываем метрики
+            record_request(method, endpoint, status_code, duration)
+        except Exception:
+            # Поток не должен умирать из-за одной ошибки, иначе фон пропадет до рестарта
+            logger.exception("Background traffic iteration failed")
         
         # Пауза между запросами
         time.sleep(random.uniform(0.1, 1.0))
 
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def access_log(response):
+    """Одна структурированная запись access log на запрос"""
+    started = g.get('request_started')
+    ACCESS_LOG.info('request', extra={'access': {
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 3) if started else None,
+        'remote_addr': request.remote_addr,
+        'user_agent': request.user_agent.string,
+        'bytes': response.calculate_content_length(),
+    }})
+    return response
+
 @app.route('/')
 def index():
     """Главная страница"""
-    REQUEST_COUNT.labels(method='GET', endpoint='/', code=200).inc()
-    with REQUEST_DURATION.labels(method='GET', endpoint='/').time():
-        time.sleep(random.uniform(0.01, 0.05))
+    status_code = simulate_request('GET', '/')
+    if status_code >= 400:
+        return jsonify({'error': 'Internal server error'}), status_code
     return jsonify({
         'service': 'monitoring-demo-app',
         'status': 'running',
@@ -75,22 +822,18 @@ def index():
 @app.route('/health')
 def health():
     """Health check endpoint"""
-    REQUEST_COUNT.labels(method='GET', endpoint='/health', code=200).inc()
-    with REQUEST_DURATION.labels(method='GET', endpoint='/health').time():
-        time.sleep(random.uniform(0.001, 0.01))
+    status_code = simulate_request('GET', '/health')
+    if status_code >= 400:
+        return jsonify({'status': 'unhealthy'}), status_code
     return jsonify({'status': 'healthy'})
 
 @app.route('/api/users')
 def users():
     """Users API endpoint"""
-    # Симуляция случайных ошибок
-    if random.random() < 0.05:  # 5% ошибок
-        REQUEST_COUNT.labels(method='GET', endpoint='/api/users', code=500).inc()
-        return jsonify({'error': 'Internal server error'}), 500
-    
-    REQUEST_COUNT.labels(method='GET', endpoint='/api/users', code=200).inc()
-    with REQUEST_DURATION.labels(method='GET', endpoint='/api/users').time():
-        time.sleep(random.uniform(0.05, 0.15))
+    # Задержка и ошибки задаются профилем endpoint'а
+    status_code = simulate_request('GET', '/api/users')
+    if status_code >= 400:
+        return jsonify({'error': 'Internal server error'}), status_code
     
     return jsonify({
         'users': [
@@ -102,15 +845,10 @@ def users():
 @app.route('/api/orders')
 def orders():
     """Orders API endpoint (медленный)"""
-    # Симуляция высокой задержки и ошибок
-    if random.random() < 0.1:  # 10% ошибок
-        REQUEST_COUNT.labels(method='GET', endpoint='/api/orders', code=500).inc()
-        return jsonify({'error': 'Database connection failed'}), 500
-    
-    REQUEST_COUNT.labels(method='GET', endpoint='/api/orders', code=200).inc()
-    with REQUEST_DURATION.labels(method='GET', endpoint='/api/orders').time():
-        # Симуляция медленного запроса к базе данных
-        time.sleep(random.uniform(0.2, 0.8))
+    # Симуляция медленного запроса к базе данных и ошибок
+    status_code = simulate_request('GET', '/api/orders')
+    if status_code >= 400:
+        return jsonify({'error': 'Database connection failed'}), status_code
     
     return jsonify({
         'orders': [
@@ -123,13 +861,9 @@ def orders():
 def products():
     """Products API endpoint"""
     # Симуляция client errors
-    if random.random() < 0.08:  # 8% client errors
-        REQUEST_COUNT.labels(method='GET', endpoint='/api/products', code=400).inc()
-        return jsonify({'error': 'Bad request'}), 400
-    
-    REQUEST_COUNT.labels(method='GET', endpoint='/api/products', code=200).inc()
-    with REQUEST_DURATION.labels(method='GET', endpoint='/api/products').time():
-        time.sleep(random.uniform(0.03, 0.12))
+    status_code = simulate_request('GET', '/api/products')
+    if status_code >= 400:
+        return jsonify({'error': 'Bad request'}), status_code
     
     return jsonify({
         'products': [
@@ -138,10 +872,43 @@ def products():
         ]
     })
 
+@app.route('/admin/faults', methods=['GET'])
+def get_faults():
+    """Текущие профили задержек/ошибок и окна деградации"""
+    return jsonify(FAULTS.config())
+
+@app.route('/admin/faults', methods=['PUT'])
+def put_faults():
+    """Обновление профилей endpoint'ов без рестарта"""
+    try:
+        FAULTS.update_profiles(request.get_json(force=True).get('profiles', {}))
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(FAULTS.config())
+
+@app.route('/admin/faults/windows', methods=['POST'])
+def add_fault_window():
+    """Запланировать окно деградации"""
+    try:
+        window = FAULTS.add_window(request.get_json(force=True))
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'error': str(e)}), 400
+    logger.info(f"Degradation window scheduled: {window}")
+    return jsonify(window), 201
+
+@app.route('/admin/faults/windows', methods=['DELETE'])
+def clear_fault_windows():
+    """Отменить все окна деградации"""
+    FAULTS.clear_windows()
+    return jsonify(FAULTS.config())
+
 @app.route('/metrics')
 def metrics():
     """Prometheus metrics endpoint"""
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+    output = generate_latest()
+    if SYNTHETIC is not None:
+        output += SYNTHETIC.render()
+    return output, 200, {'Content-Type': CONTENT_TYPE_LATEST}
 
 @app.errorhandler(404)
 def not_found(error):
@@ -161,6 +928,12 @@ if __name__ == '__main__':
     logger.info("Starting monitoring demo application...")
     logger.info("Metrics available at: http://localhost:8080/metrics")
     logger.info("Health check at: http://localhost:8080/health")
+    logger.info("Fault injection admin at: http://localhost:8080/admin/faults")
+    if SYNTHETIC is not None:
+        logger.info(f"Synthetic mode: {SYNTHETIC.series} series, labels={SYNTHETIC.label_names}, "
+                    f"churn={SYNTHETIC.churn}/s, pattern={SYNTHETIC.pattern}")
+        # Прогрев кэша префиксов, чтобы первый scrape не строил его целиком
+        SYNTHETIC.render()
     
     # Запускаем Flask приложение
     app.run(host='0.0.0.0', port=8080, debug=False)
\ No newline at end of file
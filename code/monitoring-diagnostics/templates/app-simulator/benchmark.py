@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк горячего пути инструментирования демо-приложения
+Измеряет накладные расходы на запрос, время рендера /metrics, горячий
+путь app.py в каждом HISTOGRAM_MODE и число серий/ошибку квантилей для
+раскладок бакетов гистограммы;
+результаты сохраняются в JSON для сравнения между коммитами
+GitHub: https://github.com/DevOpsBestPracticesTelegramCanal/DevOpsBestPractices
+Telegram: @DevOps_best_practices
+"""
+
+import argparse
+import json
+import logging
+import math
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from importlib import metadata
+from typing import Callable, Dict, List
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ['/api/users', '/api/orders', '/api/products', '/health', '/']
+METHODS = ['GET', 'POST', 'PUT', 'DELETE']
+CODES = ['200', '400', '500']
+
+
+def make_metrics(registry: CollectorRegistry):
+    """Те же метрики, что и в app.py, но в изолированном registry"""
+    count = Counter('http_requests_total', 'Total HTTP requests',
+                    ['method', 'endpoint', 'code'], registry=registry)
+    duration = Histogram('http_request_duration_seconds', 'HTTP request duration in seconds',
+                         ['method', 'endpoint'], registry=registry)
+    return count, duration
+
+
+def measure(func: Callable[[int], None], ops: int, repeat: int) -> Dict:
+    """Запускает func(ops) repeat раз, возвращает наносекунды на операцию"""
+    func(min(ops, 1000))  # прогрев
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        func(ops)
+        samples.append((time.perf_counter_ns() - start) / ops)
+    return {
+        'unit': 'ns/op',
+        'ops': ops,
+        'repeat': repeat,
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+# --- Micro: стоимость инструментирования одного запроса ---------------------
+
+def bench_instrumentation(ops: int, repeat: int) -> Dict[str, Dict]:
+    keys = [(m, e, c) for m in METHODS for e in ENDPOINTS for c in CODES]
+    stream = [keys[i % len(keys)] for i in range(ops)]
+    results = {}
+
+    count, duration = make_metrics(CollectorRegistry())
+
+    def labels_kwargs(n):
+        # Как в app.py: lookup по dict лейблов на каждый запрос
+        for method, endpoint, code in stream[:n]:
+            count.labels(method=method, endpoint=endpoint, code=code).inc()
+            duration.labels(method=method, endpoint=endpoint).observe(0.05)
+
+    def labels_positional(n):
+        for method, endpoint, code in stream[:n]:
+            count.labels(method, endpoint, code).inc()
+            duration.labels(method, endpoint).observe(0.05)
+
+    count_children, duration_children = {}, {}
+
+    def prebound_cache(n):
+        # Заранее связанные children: один dict lookup вместо labels()
+        for key in stream[:n]:
+            child = count_children.get(key)
+            if child is None:
+                child = count_children[key] = count.labels(*key)
+            child.inc()
+            dkey = key[:2]
+            dchild = duration_children.get(dkey)
+            if dchild is None:
+                dchild = duration_children[dkey] = duration.labels(*dkey)
+            dchild.observe(0.05)
+
+    def baseline_noop(n):
+        # Стоимость самого цикла, чтобы вычитать ее при анализе
+        for key in stream[:n]:
+            pass
+
+    for name, func in [('loop_baseline', baseline_noop),
+                       ('labels_kwargs', labels_kwargs),
+                       ('labels_positional', labels_positional),
+                       ('prebound_cache', prebound_cache)]:
+        results[f'instrumentation.{name}'] = measure(func, ops, repeat)
+        logger.info(f"instrumentation.{name}: {results[f'instrumentation.{name}']['median']:.0f} ns/op")
+    return results
+
+
+# --- Горячий путь самого app.py в каждом HISTOGRAM_MODE ---------------------
+
+HISTOGRAM_MODES = ['default', 'tuned', 'exponential']
+
+
+def bench_app(modes: List[str], ops: int, repeat: int) -> Dict[str, Dict]:
+    """app.record_request / app.simulate_request и рендер REQUEST_DURATION.
+
+    Для каждого режима app.REQUEST_DURATION на время замера подменяется
+    объектом из app.make_request_duration(mode) в отдельном registry
+    """
+    import app
+
+    endpoints = list(app.DEFAULT_PROFILES)
+    stream = []
+    for i in range(ops):
+        method, endpoint = METHODS[i % len(METHODS)], endpoints[i % len(endpoints)]
+        stream.append((method, endpoint, *app.FAULTS.sample(endpoint)))
+
+    # Те же профили ошибок, но с нулевой задержкой: time.sleep(0) вместо реального ожидания
+    instant = app.FaultInjector({
+        endpoint: {'latency': {'type': 'uniform', 'low': 0, 'high': 0}, 'errors': p['errors']}
+        for endpoint, p in app.DEFAULT_PROFILES.items()
+    })
+
+    def record(n):
+        for method, endpoint, duration, status_code in stream[:n]:
+            app.record_request(method, endpoint, status_code, duration)
+
+    def simulate(n):
+        for method, endpoint, _, _ in stream[:n]:
+            app.simulate_request(method, endpoint)
+
+    results = {}
+    original_duration, original_faults = app.REQUEST_DURATION, app.FAULTS
+    try:
+        for mode in modes:
+            registry = CollectorRegistry()
+            app.REQUEST_DURATION = app.make_request_duration(mode, registry=registry)
+            app.FAULTS = instant
+            for name, func in [('record_request', record), ('simulate_request', simulate)]:
+                result = measure(func, ops, repeat)
+                results[f'app.{mode}.{name}'] = result
+                logger.info(f"app.{mode}.{name}: {result['median']:.0f} ns/op")
+
+            def render(n):
+                for _ in range(n):
+                    generate_latest(registry)
+
+            result = measure(render, 1, repeat)
+            result.update({'unit': 'ns/scrape', 'bytes': len(generate_latest(registry))})
+            results[f'app.{mode}.exposition'] = result
+            logger.info(f"app.{mode}.exposition: {result['median'] / 1e3:.0f} us/scrape, "
+                        f"{result['bytes']} bytes")
+    finally:
+        app.REQUEST_DURATION, app.FAULTS = original_duration, original_faults
+    return results
+
+
+# --- Macro: рендер /metrics в зависимости от числа серий --------------------
+
+def populate(series: int) -> CollectorRegistry:
+    """Registry с ~series сериями http_requests_total и гистограммой на каждую"""
+    registry = CollectorRegistry()
+    count, duration = make_metrics(registry)
+    for i in range(series):
+        method, endpoint = METHODS[i % len(METHODS)], f'/api/item/{i}'
+        count.labels(method, endpoint, '200').inc()
+        duration.labels(method, endpoint).observe(0.05)
+    return registry
+
+
+def bench_exposition(series_counts: List[int], repeat: int) -> Dict[str, Dict]:
+    results = {}
+    for series in series_counts:
+        registry = populate(series)
+        size = len(generate_latest(registry))
+
+        def render(n):
+            for _ in range(n):
+                generate_latest(registry)
+
+        result = measure(render, 1, repeat)
+        result.update({'unit': 'ns/scrape', 'series': series, 'bytes': size})
+        results[f'exposition.series_{series}'] = result
+        logger.info(f"exposition.series_{series}: {result['median'] / 1e6:.1f} ms/scrape, {size} bytes")
+    return results
+
+
+# --- Раскладки гистограмм: число серий и ошибка квантилей -------------------
+
+# Тяжелый хвост в дополнение к профилям app.py по умолчанию
+HEAVY_TAIL_PROFILE = {'type': 'mixture', 'components': [
+    {'weight': 0.9, 'type': 'lognormal', 'median': 0.08, 'sigma': 0.4},
+    {'weight': 0.1, 'type': 'pareto', 'scale': 0.3, 'alpha': 1.5, 'max': 10.0},
+]}
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+def histogram_quantile(q: float, buckets: List) -> float:
+    """Та же линейная интерполяция, что и у histogram_quantile() в Prometheus"""
+    total = buckets[-1][1]
+    rank = q * total
+    prev_bound, prev_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float('inf'):
+                return prev_bound
+            if count == prev_count:
+                return bound
+            return prev_bound + (bound - prev_bound) * (rank - prev_count) / (count - prev_count)
+        prev_bound, prev_count = bound, count
+    return prev_bound
+
+
+def exact_quantile(q: float, values: List[float]) -> float:
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def bench_histograms(samples: int) -> Dict[str, Dict]:
+    import app  # раскладки и профили задержек берутся из самого приложения
+
+    profiles = {endpoint: p['latency'] for endpoint, p in app.DEFAULT_PROFILES.items()}
+    profiles['/api/heavy-tail'] = HEAVY_TAIL_PROFILE
+    # Фиксированный seed: ошибки квантилей сравниваются между запусками (--compare)
+    random.seed(samples)
+    observations = {endpoint: sorted(app.sample_latency(spec) for _ in range(samples))
+                    for endpoint, spec in profiles.items()}
+
+    default_layout = app.FixedLayout(Histogram.DEFAULT_BUCKETS)
+    tuned = {endpoint: app.FixedLayout(bounds) for endpoint, bounds in app.ENDPOINT_BUCKETS.items()}
+    variants = {
+        'default': lambda labels: default_layout,
+        'tuned': lambda labels: tuned.get(labels['endpoint'], tuned['*']),
+    }
+    for schema in (1, 2, 3):
+        # Без ограничения числа границ: чистая сетка данной schema
+        exponential = {endpoint: app.ExponentialLayout(min(bounds), max(bounds), schema, 1000)
+                       for endpoint, bounds in app.ENDPOINT_BUCKETS.items()}
+        variants[f'exponential_schema_{schema}'] = lambda labels, layouts=exponential: layouts.get(
+            labels['endpoint'], layouts['*'])
+
+    results = {}
+    for name, layout_for in variants.items():
+        histogram = app.LayoutHistogram('bench_duration_seconds', 'bench', ['endpoint'],
+                                        layout_for, registry=None)
+        for endpoint, values in observations.items():
+            child = histogram.labels(endpoint)
+            for value in values:
+                child.observe(value)
+
+        family = next(histogram.collect())
+        per_endpoint = {}
+        for sample in family.samples:
+            if sample.name.endswith('_bucket'):
+                per_endpoint.setdefault(sample.labels['endpoint'], []).append(
+                    (float(sample.labels['le']), sample.value))
+
+        result = {'unit': 'relative_error', 'series': len(family.samples), 'samples': samples}
+        for q in QUANTILES:
+            errors = []
+            for endpoint, buckets in per_endpoint.items():
+                exact = exact_quantile(q, observations[endpoint])
+                errors.append(abs(histogram_quantile(q, buckets) - exact) / exact)
+            result[f'p{q * 100:g}_max_error'] = max(errors)
+            result[f'p{q * 100:g}_mean_error'] = statistics.mean(errors)
+        results[f'histogram.{name}'] = result
+        logger.info(f"histogram.{name}: {result['series']} series, "
+                    f"p99 error max {result['p99_max_error']:.1%} mean {result['p99_mean_error']:.1%}")
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or 'unknown'
+    except (OSError, subprocess.TimeoutExpired):
+        return 'unknown'
+
+
+def compare(current: Dict, baseline: Dict, threshold: float, error_threshold: float) -> List[str]:
+    """Сравнение с baseline, возвращает список регрессий.
+
+    Время - по min (наименее шумная оценка), регрессия при замедлении сверх
+    threshold. Раскладки гистограмм - по числу серий (рост сверх threshold)
+    и ошибкам квантилей (рост больше чем на error_threshold абсолютно)
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        if result['unit'] == 'relative_error':
+            checks = [('series', result['series'], old.get('series'), 'series')]
+            checks += [(key, value, old.get(key), 'error')
+                       for key, value in result.items() if key.endswith('_error')]
+        else:
+            checks = [('min', result['min'], old.get('min'), result['unit'])]
+
+        for key, new_value, old_value, unit in checks:
+            if old_value is None or (unit != 'error' and not old_value):
+                continue
+            if unit == 'error':
+                change = new_value - old_value
+                regressed = change > error_threshold
+                change_text = f"{change * 100:+6.1f}pp"
+            else:
+                change = new_value / old_value - 1
+                # loop_baseline - только точка отсчета, не регрессия приложения
+                regressed = change > threshold and not name.endswith('loop_baseline')
+                change_text = f"{change:+7.1%}"
+            label = name if key == 'min' else f'{name}.{key}'
+            marker = 'REGRESSION' if regressed else 'ok'
+            fmt = '.4f' if unit == 'error' else '.0f'
+            print(f"{label:45s} {old_value:14{fmt}} -> {new_value:14{fmt}} {unit:10s} "
+                  f"{change_text}  {marker}")
+            if regressed:
+                regressions.append(label)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark demo app instrumentation hot path')
+    parser.add_argument('--ops', type=int, default=100000,
+                        help='Instrumented requests per micro benchmark run')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per benchmark (median and min are reported)')
+    parser.add_argument('--series', default='100,1000,10000',
+                        help='Comma separated series counts for exposition benchmark')
+    parser.add_argument('--histogram-modes', default=','.join(HISTOGRAM_MODES),
+                        help='Comma separated HISTOGRAM_MODE values to benchmark app.py in (empty = skip)')
+    parser.add_argument('--histogram-samples', type=int, default=20000,
+                        help='Observations per endpoint for histogram layout comparison (0 = skip)')
+    parser.add_argument('--output', default='benchmark-results.json',
+                        help='Where to write JSON results')
+    parser.add_argument('--compare', metavar='BASELINE_JSON',
+                        help='Compare with previous results, exit 1 on regression')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Allowed slowdown or series growth before reporting a regression (0.10 = 10%%)')
+    parser.add_argument('--error-threshold', type=float, default=0.02,
+                        help='Allowed absolute growth of quantile error (0.02 = 2 percentage points)')
+
+    args = parser.parse_args()
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'prometheus_client': metadata.version('prometheus-client'),
+        'platform': platform.platform(),
+        'results': {},
+    }
+    report['results'].update(bench_instrumentation(args.ops, args.repeat))
+    report['results'].update(bench_exposition([int(s) for s in args.series.split(',')], args.repeat))
+    if args.histogram_modes:
+        report['results'].update(bench_app(args.histogram_modes.split(','), args.ops, args.repeat))
+    if args.histogram_samples:
+        report['results'].update(bench_histograms(args.histogram_samples))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.error_threshold)
+        if regressions:
+            logger.error(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,15 +8,69 @@ Telegram: @DevOps_best_practices
 
 import asyncio
 import aiohttp
+import json
 import random
 import time
 import logging
+from types import SimpleNamespace
 from typing import List, Dict
+from prometheus_client import Counter, Histogram, REGISTRY, start_http_server
+from prometheus_client.core import GaugeMetricFamily
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Клиентские метрики (отдаются на --metrics-port во время прогона)
+CLIENT_REQUESTS = Counter(
+    'loadgen_requests_total',
+    'Requests completed by the load generator',
+    ['endpoint', 'code']
+)
+
+CLIENT_DURATION = Histogram(
+    'loadgen_request_duration_seconds',
+    'Client-side request duration in seconds',
+    ['endpoint']
+)
+
+CLIENT_ERRORS = Counter(
+    'loadgen_errors_total',
+    'Failed requests by error class',
+    ['endpoint', 'class']
+)
+
+CLIENT_CONNECTIONS = Counter(
+    'loadgen_connections_total',
+    'Connections taken from the pool, by whether they were newly created or reused',
+    ['source']
+)
+
+class LoadGeneratorCollector:
+    """Состояние генератора, читаемое только во время scrape.
+
+    Счетчики меняются только на event loop (запросы и trace callbacks
+    aiohttp), collect() в потоке HTTP сервера метрик читает готовые числа
+    и не трогает внутренние структуры connector'а.
+    """
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def collect(self):
+        generator = self.generator
+        yield GaugeMetricFamily('loadgen_target_rps', 'Target request rate of the current load step',
+                                value=generator.target_rps)
+        yield GaugeMetricFamily('loadgen_inflight_requests', 'Requests currently in flight',
+                                value=generator.inflight)
+        yield GaugeMetricFamily('loadgen_connection_pool_in_use', 'Connections acquired from the pool',
+                                value=generator.pool_in_use)
+        yield GaugeMetricFamily('loadgen_connection_pool_waiting',
+                                'Requests waiting for a free connection in the pool',
+                                value=generator.pool_waiting)
+        yield GaugeMetricFamily('loadgen_connection_pool_limit', 'Connection pool size limit',
+                                value=generator.pool_limit)
+
 class LoadGenerator:
     def __init__(self, base_url: str = "http://localhost:8080"):
         self.base_url = base_url
@@ -28,11 +82,81 @@ class LoadGenerator:
             {'path': '/api/orders', 'weight': 15},
             {'path': '/api/products', 'weight': 10}
         ]
+        self.target_rps = 0.0
+        self.inflight = 0
+        # Пул соединений по trace callbacks (см. _trace_config)
+        self.pool_in_use = 0
+        self.pool_waiting = 0
+        self.pool_queued_total = 0
+        self.pool_limit = 0
+        self._connection_children = {source: CLIENT_CONNECTIONS.labels(source)
+                                     for source in ('created', 'reused')}
+        # Заранее связанные children метрик: без labels() на каждый запрос
+        self._request_children = {}
+        self._duration_children = {}
+        self._error_children = {}
+        
+    def start_metrics_server(self, port: int):
+        """Отдает /metrics генератора для Prometheus"""
+        REGISTRY.register(LoadGeneratorCollector(self))
+        start_http_server(port)
+        logger.info(f"Load generator metrics at: http://localhost:{port}/metrics")
         
-    async def create_session(self):
-        """Создание HTTP сессии"""
+    async def create_session(self, pool_limit: int = 100):
+        """Создание HTTP сессии (pool_limit - размер пула соединений aiohttp)"""
         timeout = aiohttp.ClientTimeout(total=10)
-        self.session = aiohttp.ClientSession(timeout=timeout)
+        connector = aiohttp.TCPConnector(limit=pool_limit)
+        self.pool_limit = connector.limit
+        self.session = aiohttp.ClientSession(timeout=timeout, connector=connector,
+                                             trace_configs=[self._trace_config()])
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        """Учет занятых соединений и ожидания пула через публичные сигналы aiohttp.
+
+        Состояние запроса (queued/holding) передается в trace_request_ctx и
+        снимается в _request после выхода из "async with", когда соединение
+        уже возвращено в пул, даже если конечный сигнал не пришел (отмена)
+        """
+        trace = aiohttp.TraceConfig()
+
+        async def on_queued_start(session, ctx, params):
+            self.pool_queued_total += 1
+            if ctx.trace_request_ctx is not None:
+                ctx.trace_request_ctx.queued = True
+                self.pool_waiting += 1
+
+        async def on_queued_end(session, ctx, params):
+            self._leave_queue(ctx.trace_request_ctx)
+
+        def on_acquired(source):
+            async def callback(session, ctx, params):
+                self._connection_children[source].inc()
+                state = ctx.trace_request_ctx
+                if state is not None and not state.holding:
+                    state.holding = True
+                    self.pool_in_use += 1
+            return callback
+
+        async def on_redirect(session, ctx, params):
+            # Соединение предыдущего ответа освобождается перед следующим запросом
+            self._release_connection(ctx.trace_request_ctx)
+
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        trace.on_connection_create_end.append(on_acquired('created'))
+        trace.on_connection_reuseconn.append(on_acquired('reused'))
+        trace.on_request_redirect.append(on_redirect)
+        return trace
+
+    def _leave_queue(self, state):
+        if state is not None and state.queued:
+            state.queued = False
+            self.pool_waiting -= 1
+
+    def _release_connection(self, state):
+        if state is not None and state.holding:
+            state.holding = False
+            self.pool_in_use -= 1
         
     async def close_session(self):
         """Закрытие HTTP сессии"""
@@ -40,11 +164,47 @@ class LoadGenerator:
             await self.session.close()
             
     async def make_request(self, endpoint: str) -> Dict:
+        """Выполнение HTTP запроса с записью клиентских метрик"""
+        self.inflight += 1
+        try:
+            result = await self._request(endpoint)
+        finally:
+            self.inflight -= 1
+        self.record(result)
+        return result
+
+    def record(self, result: Dict):
+        """Запись клиентских метрик по результату запроса"""
+        endpoint, error_class = result['endpoint'], result.get('error_class')
+        code = 'error' if error_class else str(result['status_code'])
+
+        child = self._request_children.get((endpoint, code))
+        if child is None:
+            child = self._request_children[(endpoint, code)] = CLIENT_REQUESTS.labels(endpoint, code)
+        child.inc()
+
+        if error_class in (None, 'timeout'):
+            child = self._duration_children.get(endpoint)
+            if child is None:
+                child = self._duration_children[endpoint] = CLIENT_DURATION.labels(endpoint)
+            child.observe(result['duration'])
+
+        if error_class is None and result['status_code'] >= 400:
+            error_class = 'http_5xx' if result['status_code'] >= 500 else 'http_4xx'
+        if error_class:
+            child = self._error_children.get((endpoint, error_class))
+            if child is None:
+                child = self._error_children[(endpoint, error_class)] = CLIENT_ERRORS.labels(endpoint, error_class)
+            child.inc()
+
+    async def _request(self, endpoint: str) -> Dict:
         """Выполнение HTTP запроса"""
+        pool_state = SimpleNamespace(queued=False, holding=False)
         try:
             start_time = time.time()
             
-            async with self.session.get(f"{self.base_url}{endpoint}") as response:
+            async with self.session.get(f"{self.base_url}{endpoint}",
+                                        trace_request_ctx=pool_state) as response:
                 duration = time.time() - start_time
                 content = await response.text()
                 
@@ -61,7 +221,17 @@ class LoadGenerator:
                 'status_code': 408,
                 'duration': 10.0,
                 'success': False,
-                'error': 'timeout'
+                'error': 'timeout',
+                'error_class': 'timeout'
+            }
+        except aiohttp.ClientConnectionError as e:
+            return {
+                'endpoint': endpoint,
+                'status_code': 500,
+                'duration': 0,
+                'success': False,
+                'error': str(e),
+                'error_class': 'connection'
             }
         except Exception as e:
             return {
@@ -69,8 +239,12 @@ class LoadGenerator:
                 'status_code': 500,
                 'duration': 0,
                 'success': False,
-                'error': str(e)
+                'error': str(e),
+                'error_class': 'other'
             }
+        finally:
+            self._leave_queue(pool_state)
+            self._release_connection(pool_state)
     
     def get_weighted_endpoint(self) -> str:
         """Выбор endpoint с учетом весов"""
@@ -84,6 +258,7 @@ class LoadGenerator:
         
         end_time = time.time() + duration
         interval = 1.0 / rps
+        self.target_rps = rps
         
         while time.time() < end_time:
             endpoint = self.get_weighted_endpoint()
@@ -115,6 +290,7 @@ class LoadGenerator:
         logger.info(f"Generating error burst for {duration} seconds")
         
         end_time = time.time() + duration
+        self.target_rps = 10
         
         while time.time() < end_time:
             # Увеличиваем вероятность запросов к проблемным endpoints
@@ -126,6 +302,158 @@ class LoadGenerator:
             result = await self.make_request(endpoint)
             await asyncio.sleep(0.1)  # 10 RPS
     
+    async def run_at_rate(self, rps: float, duration: float, max_inflight: int = 1000) -> Dict:
+        """Open-loop нагрузка: запросы стартуют по расписанию, не дожидаясь ответов"""
+        interval = 1.0 / rps
+        self.target_rps = rps
+        queued_before = self.pool_queued_total
+        results: List[Dict] = []
+        tasks = set()
+        skipped = 0
+
+        def on_done(task):
+            tasks.discard(task)
+            results.append(task.result())
+
+        start = time.monotonic()
+        next_at, end = start, start + duration
+        sent = 0
+        while next_at < end:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(tasks) >= max_inflight:
+                # Клиент не успевает - сервер уже не держит этот rate
+                skipped += 1
+            else:
+                task = asyncio.ensure_future(self.make_request(self.get_weighted_endpoint()))
+                tasks.add(task)
+                task.add_done_callback(on_done)
+                sent += 1
+            next_at += interval
+        sending = time.monotonic() - start
+
+        if tasks:
+            await asyncio.wait(set(tasks))
+        step = self.summarize(rps, results, time.monotonic() - start, skipped)
+        # Скорость отправки: отставание event loop'а или упор в max_inflight
+        step['achieved_rps'] = sent / sending if sending else 0.0
+        # Запросы, ждавшие свободного соединения в пуле самого генератора
+        step['pool_queued'] = self.pool_queued_total - queued_before
+        return step
+
+    @staticmethod
+    def summarize(rps: float, results: List[Dict], elapsed: float, skipped: int = 0) -> Dict:
+        """Клиентская статистика шага: достигнутый rate, перцентили, доля ошибок"""
+        latencies = sorted(r['duration'] for r in results)
+        # 5xx, таймауты и ошибки соединения; 4xx - ответ клиенту, а не отказ сервиса
+        errors = sum(1 for r in results if r['status_code'] >= 500 or 'error' in r)
+        total = len(results) + skipped
+
+        def percentile(q):
+            if not latencies:
+                return float('inf')
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            'target_rps': rps,
+            'achieved_rps': len(results) / elapsed if elapsed else 0.0,
+            'throughput_rps': len(results) / elapsed if elapsed else 0.0,
+            'requests': len(results),
+            'skipped': skipped,
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+            'error_rate': (errors + skipped) / total if total else 1.0,
+        }
+
+    async def find_capacity(self, slo_p99: float = 1.0, slo_error_rate: float = 0.05,
+                            start_rps: float = 5, max_rps: float = 2000,
+                            step_duration: int = 20, precision: float = 0.05,
+                            knee_factor: float = 2.0, max_inflight: int = 1000,
+                            min_rps: float = 1.0) -> Dict:
+        """Поиск максимального rate, при котором выполняется SLO.
+
+        Сначала rate удваивается, пока шаг проходит проверку (если не проходит
+        уже стартовый - делится пополам до min_rps), затем граница уточняется
+        бинарным поиском до заданной относительной точности.
+        Шаг не проходит, если нарушен SLO по p99 или ошибкам, если достигнутый
+        rate ниже 90% целевого, если p99 вырос больше чем в knee_factor раз
+        относительно лучшего p99 - это колено кривой задержки, или если
+        запросы ждали соединения в пуле генератора: такая задержка - очередь
+        клиента, а не сервера.
+        """
+        if self.pool_limit < max_inflight:
+            logger.warning(f"Connection pool limit {self.pool_limit} < max_inflight {max_inflight}: "
+                           f"steps that queue for the client pool will fail")
+        curve: List[Dict] = []
+        best_p99 = float('inf')
+
+        async def probe(rps: float) -> bool:
+            nonlocal best_p99
+            logger.info(f"Capacity step: {rps:.1f} RPS for {step_duration}s")
+            step = await self.run_at_rate(rps, step_duration, max_inflight)
+            reasons = []
+            if step['p99'] > slo_p99:
+                reasons.append(f"p99 {step['p99']:.3f}s > {slo_p99}s")
+            if step['error_rate'] > slo_error_rate:
+                reasons.append(f"errors {step['error_rate']:.2%} > {slo_error_rate:.2%}")
+            if step['achieved_rps'] < 0.9 * rps:
+                reasons.append(f"achieved {step['achieved_rps']:.1f} RPS")
+            if step['p99'] > knee_factor * best_p99:
+                reasons.append(f"latency knee: p99 {step['p99']:.3f}s > {knee_factor} x {best_p99:.3f}s")
+            if step['pool_queued']:
+                reasons.append(f"{step['pool_queued']} requests queued for the client connection pool "
+                               f"(limit {self.pool_limit})")
+            best_p99 = min(best_p99, step['p99'])
+            step['passed'] = not reasons
+            step['reasons'] = reasons
+            curve.append(step)
+            logger.info(f"  achieved {step['achieved_rps']:.1f} RPS, p50 {step['p50']:.3f}s, "
+                        f"p99 {step['p99']:.3f}s, errors {step['error_rate']:.2%} -> "
+                        f"{'PASS' if step['passed'] else 'FAIL: ' + '; '.join(reasons)}")
+            return step['passed']
+
+        good, bad = 0.0, None
+        rps = min(start_rps, max_rps)
+        while True:
+            if not await probe(rps):
+                bad = rps
+                break
+            good = rps
+            if rps >= max_rps:
+                break
+            rps = min(rps * 2, max_rps)
+
+        if bad is not None and not good:
+            # Стартовый rate уже не проходит - ищем проходящий вниз
+            rps = bad / 2
+            while rps >= min_rps:
+                if await probe(rps):
+                    good = rps
+                    break
+                bad = rps
+                rps /= 2
+            if not good:
+                logger.warning(f"SLO not met even at {bad:.2f} RPS (--min-rps {min_rps})")
+
+        if bad is None:
+            logger.warning(f"SLO still met at --max-rps {max_rps}, capacity is higher")
+        elif good:
+            while (bad - good) / good > precision:
+                middle = (good + bad) / 2
+                if await probe(middle):
+                    good = middle
+                else:
+                    bad = middle
+
+        return {
+            'max_sustainable_rps': good,
+            'first_failing_rps': bad,
+            'slo': {'p99': slo_p99, 'error_rate': slo_error_rate, 'knee_factor': knee_factor},
+            'curve': sorted(curve, key=lambda s: s['target_rps']),
+        }
+
     async def run_realistic_scenario(self):
         """Реалистичный сценарий нагрузки"""
         scenarios = [
@@ -151,19 +479,42 @@ async def main():
     parser = argparse.ArgumentParser(description='Load generator for demo app')
     parser.add_argument('--url', default='http://localhost:8080', 
                        help='Base URL of the demo app')
-    parser.add_argument('--mode', choices=['steady', 'spike', 'errors', 'realistic'], 
+    parser.add_argument('--mode', choices=['steady', 'spike', 'errors', 'realistic', 'capacity'], 
                        default='realistic', help='Load generation mode')
     parser.add_argument('--rps', type=int, default=10, 
-                       help='Requests per second for steady mode')
+                       help='Requests per second for steady mode (start rate for capacity mode)')
     parser.add_argument('--duration', type=int, default=300, 
                        help='Duration in seconds')
+    parser.add_argument('--slo-p99', type=float, default=1.0,
+                       help='Capacity mode: client-side p99 latency SLO in seconds')
+    parser.add_argument('--slo-error-rate', type=float, default=0.05,
+                       help='Capacity mode: max share of 5xx/timeouts/connection errors')
+    parser.add_argument('--max-rps', type=float, default=2000,
+                       help='Capacity mode: upper bound of the search')
+    parser.add_argument('--step-duration', type=int, default=20,
+                       help='Capacity mode: seconds of load per step')
+    parser.add_argument('--precision', type=float, default=0.05,
+                       help='Capacity mode: relative precision of the binary search')
+    parser.add_argument('--knee-factor', type=float, default=2.0,
+                       help='Capacity mode: p99 growth over best p99 treated as the latency knee')
+    parser.add_argument('--max-inflight', type=int, default=1000,
+                       help='Capacity mode: max concurrent requests (also the connection pool size)')
+    parser.add_argument('--min-rps', type=float, default=1.0,
+                       help='Capacity mode: lowest rate tried when the start rate already fails')
+    parser.add_argument('--report', help='Capacity mode: write JSON report to this file')
+    parser.add_argument('--metrics-port', type=int, default=9105,
+                       help='Port for the generator /metrics endpoint (0 disables it)')
     
     args = parser.parse_args()
     
     generator = LoadGenerator(args.url)
+    if args.metrics_port:
+        generator.start_metrics_server(args.metrics_port)
     
     try:
-        await generator.create_session()
+        # В capacity режиме пул не меньше max_inflight: иначе очередь за
+        # соединением на клиенте попала бы в p99 и колено как задержка сервера
+        await generator.create_session(args.max_inflight if args.mode == 'capacity' else 100)
         
         # Проверка доступности приложения
         result = await generator.make_request('/health')
@@ -181,6 +532,23 @@ async def main():
             await generator.generate_error_burst(args.duration)
         elif args.mode == 'realistic':
             await generator.run_realistic_scenario()
+        elif args.mode == 'capacity':
+            report = await generator.find_capacity(
+                slo_p99=args.slo_p99, slo_error_rate=args.slo_error_rate,
+                start_rps=args.rps, max_rps=args.max_rps,
+                step_duration=args.step_duration, precision=args.precision,
+                knee_factor=args.knee_factor, max_inflight=args.max_inflight,
+                min_rps=args.min_rps)
+            print(f"{'target':>10} {'achieved':>10} {'p50':>8} {'p99':>8} {'errors':>8}  result")
+            for step in report['curve']:
+                print(f"{step['target_rps']:10.1f} {step['achieved_rps']:10.1f} "
+                      f"{step['p50']:8.3f} {step['p99']:8.3f} {step['error_rate']:8.2%}  "
+                      f"{'PASS' if step['passed'] else 'FAIL'}")
+            logger.info(f"Max sustainable throughput: {report['max_sustainable_rps']:.1f} RPS "
+                        f"(p99 <= {args.slo_p99}s, errors <= {args.slo_error_rate:.2%})")
+            if args.report:
+                with open(args.report, 'w') as f:
+                    json.dump(report, f, indent=2)
             
     except KeyboardInterrupt:
         logger.info("Load generation stopped by user")
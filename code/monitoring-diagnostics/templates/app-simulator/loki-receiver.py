@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка Loki push API для проверки access log демо-приложения
+Принимает /loki/api/v1/push, проверяет формат и считает записи;
+умеет имитировать медленный или падающий Loki
+GitHub: https://github.com/DevOpsBestPracticesTelegramCanal/DevOpsBestPractices
+Telegram: @DevOps_best_practices
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def validate_push(payload: dict) -> int:
+    """Проверка тела push запроса, возвращает число записей"""
+    entries = 0
+    for stream in payload['streams']:
+        if not isinstance(stream['stream'], dict) or not stream['stream']:
+            raise ValueError("stream labels must be a non-empty object")
+        for ts, line in stream['values']:
+            int(ts)  # наносекунды строкой
+            json.loads(line)  # access log - JSON строки
+            entries += 1
+    return entries
+
+
+class PushHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != '/loki/api/v1/push':
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+
+        if server.delay:
+            time.sleep(server.delay)
+        if random.random() < server.fail_rate:
+            with server.lock:
+                server.stats['failed'] += 1
+            self.send_error(503, 'simulated failure')
+            return
+
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            payload = json.loads(body)
+            entries = validate_push(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            with server.lock:
+                server.stats['rejected'] += 1
+            self.send_error(400, f'bad push payload: {e}')
+            return
+
+        with server.lock:
+            server.stats['pushes'] += 1
+            server.stats['entries'] += entries
+            server.stats['bytes'] += len(body)
+            total = server.stats['entries']
+        elapsed = time.monotonic() - server.started
+        logger.info(f"push: {entries} entries in {len(payload['streams'])} streams; "
+                    f"total {total} entries, {total / elapsed:.1f} entries/s")
+        if server.verbose:
+            for stream in payload['streams']:
+                for _, line in stream['values']:
+                    logger.info(f"  {stream['stream']} {line}")
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stand-in Loki push API receiver')
+    parser.add_argument('--host', default='127.0.0.1', help='Bind address')
+    parser.add_argument('--port', type=int, default=3100, help='Port to listen on')
+    parser.add_argument('--delay', type=float, default=0.0,
+                       help='Seconds to wait before answering each push (slow Loki)')
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                       help='Share of pushes answered with 503')
+    parser.add_argument('--verbose', action='store_true', help='Print every received entry')
+
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), PushHandler)
+    server.delay = args.delay
+    server.fail_rate = args.fail_rate
+    server.verbose = args.verbose
+    server.stats = Counter()
+    server.lock = threading.Lock()
+    server.started = time.monotonic()
+
+    logger.info(f"Loki stand-in listening on http://{args.host}:{args.port}/loki/api/v1/push")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Receiver stopped by user")
+    finally:
+        server.server_close()
+        logger.info(f"Totals: {dict(server.stats)}")
+
+
+if __name__ == "__main__":
+    main()
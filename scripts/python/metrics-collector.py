@@ -1,11 +1,44 @@
 #!/usr/bin/env python3
 """
 Simple metrics collector example
+
+Without arguments prints a single JSON snapshot of system metrics.
+
+With --remote-write URL the collector runs in a loop and pushes samples to a
+Prometheus remote_write endpoint (protobuf + snappy), batching by size/time,
+retrying with backoff and spilling batches to disk while the endpoint is down.
+
+With --receiver it starts a local stand-in remote_write endpoint that decodes
+payloads and reports sample throughput.
 """
 
-import psutil
+import argparse
+import collections
 import json
+import logging
+import os
+import random
+import socket
+import struct
+import threading
+import time
+import urllib.error
+import urllib.request
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import psutil
+except ImportError:  # only required for collection, not for --receiver
+    psutil = None
+
+try:
+    import snappy  # python-snappy, used when available
+except ImportError:
+    snappy = None
+
+logger = logging.getLogger("metrics-collector")
+
 
 def collect_metrics():
     """Collect system metrics"""
@@ -17,6 +50,552 @@ def collect_metrics():
     }
     return metrics
 
+
+def metrics_to_samples(metrics, job, instance):
+    """Flatten collect_metrics() output into (labels, value, timestamp_ms)"""
+    ts_ms = int(datetime.fromisoformat(metrics["timestamp"]).timestamp() * 1000)
+    base = {"job": job, "instance": instance}
+    samples = [({"__name__": "node_cpu_percent", **base}, float(metrics["cpu_percent"]), ts_ms)]
+    for group in ("memory", "disk"):
+        for field, value in metrics[group].items():
+            name = f"node_{group}_{field}"
+            samples.append(({"__name__": name, **base}, float(value), ts_ms))
+    return samples
+
+
+# --- Protobuf encoding of prometheus.WriteRequest -------------------------
+#
+# message WriteRequest { repeated TimeSeries timeseries = 1; }
+# message TimeSeries   { repeated Label labels = 1; repeated Sample samples = 2; }
+# message Label        { string name = 1; string value = 2; }
+# message Sample       { double value = 1; int64 timestamp = 2; }
+
+def _varint(value):
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _field(number, payload):
+    """Length-delimited field (wire type 2)"""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_write_request(samples):
+    """Encode samples as WriteRequest, grouping them into series by label set"""
+    series = collections.OrderedDict()
+    for labels, value, ts_ms in samples:
+        key = tuple(sorted(labels.items()))
+        series.setdefault(key, []).append((value, ts_ms))
+
+    out = bytearray()
+    for key, points in series.items():
+        ts = bytearray()
+        for name, value in key:
+            ts += _field(1, _field(1, name.encode()) + _field(2, str(value).encode()))
+        for value, ts_ms in points:
+            sample = b"\x09" + struct.pack("<d", value) + b"\x10" + _varint(ts_ms)
+            ts += _field(2, sample)
+        out += _field(1, bytes(ts))
+    return bytes(out)
+
+
+def _iter_fields(data):
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type == 5:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"unsupported wire type {wire_type}")
+        yield number, wire_type, value
+
+
+def decode_write_request(data):
+    """Decode WriteRequest into a list of (labels, [(value, timestamp_ms)])"""
+    result = []
+    for number, _, ts in _iter_fields(data):
+        if number != 1:
+            continue
+        labels, points = {}, []
+        for ts_number, _, payload in _iter_fields(ts):
+            if ts_number == 1:
+                label = {n: v.decode() for n, _, v in _iter_fields(payload)}
+                labels[label.get(1, "")] = label.get(2, "")
+            elif ts_number == 2:
+                value, ts_ms = 0.0, 0
+                for s_number, _, raw in _iter_fields(payload):
+                    if s_number == 1:
+                        value = struct.unpack("<d", raw)[0]
+                    elif s_number == 2:
+                        ts_ms = raw - (1 << 64) if raw >= 1 << 63 else raw
+                points.append((value, ts_ms))
+        result.append((labels, points))
+    return result
+
+
+# --- Snappy block format ---------------------------------------------------
+#
+# remote_write requires the snappy *block* format. python-snappy is used when
+# installed; otherwise a small pure-Python codec keeps the script dependency
+# free (greedy 4-byte hash matching, offsets limited to 64 KiB).
+
+def _snappy_literal(out, data, start, end):
+    while start < end:
+        length = min(end - start, 1 << 16)
+        n = length - 1
+        if n < 60:
+            out.append(n << 2)
+        elif n < 1 << 8:
+            out += bytes((60 << 2, n))
+        else:
+            out += bytes((61 << 2,)) + struct.pack("<H", n)
+        out += data[start:start + length]
+        start += length
+
+
+def _snappy_copy(out, offset, length):
+    while length > 0:
+        chunk = min(length, 64)
+        if 4 <= chunk <= 11 and offset < 2048:
+            out += bytes((0x01 | (chunk - 4) << 2 | (offset >> 8) << 5, offset & 0xFF))
+        else:
+            out += bytes((0x02 | (chunk - 1) << 2,)) + struct.pack("<H", offset)
+        length -= chunk
+
+
+def snappy_compress(data):
+    if snappy is not None:
+        return snappy.compress(data)
+    data = bytes(data)
+    out = bytearray(_varint(len(data)))
+    table = {}
+    pos = literal_start = 0
+    limit = len(data) - 4
+    while pos <= limit:
+        key = data[pos:pos + 4]
+        candidate = table.get(key)
+        table[key] = pos
+        if candidate is None or pos - candidate > 0xFFFF:
+            pos += 1
+            continue
+        length = 4
+        while pos + length < len(data) and data[candidate + length] == data[pos + length]:
+            length += 1
+        _snappy_literal(out, data, literal_start, pos)
+        _snappy_copy(out, pos - candidate, length)
+        pos += length
+        literal_start = pos
+    _snappy_literal(out, data, literal_start, len(data))
+    return bytes(out)
+
+
+def snappy_decompress(data):
+    if snappy is not None:
+        return snappy.uncompress(data)
+    expected, pos = _read_varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 0x03
+        if kind == 0:
+            length = tag >> 2
+            if length >= 60:
+                extra = length - 59
+                length = int.from_bytes(data[pos:pos + extra], "little")
+                pos += extra
+            length += 1
+            out += data[pos:pos + length]
+            pos += length
+            continue
+        if kind == 1:
+            length = ((tag >> 2) & 0x07) + 4
+            offset = (tag >> 5) << 8 | data[pos]
+            pos += 1
+        elif kind == 2:
+            length = (tag >> 2) + 1
+            offset = struct.unpack_from("<H", data, pos)[0]
+            pos += 2
+        else:
+            length = (tag >> 2) + 1
+            offset = struct.unpack_from("<I", data, pos)[0]
+            pos += 4
+        if not 0 < offset <= len(out):
+            raise ValueError("snappy: invalid copy offset")
+        start = len(out) - offset
+        for i in range(length):
+            out.append(out[start + i])
+    if len(out) != expected:
+        raise ValueError("snappy: length mismatch")
+    return bytes(out)
+
+
+# --- Shipping --------------------------------------------------------------
+
+class RecoverableError(Exception):
+    """Send failed but may succeed on retry (network error, 5xx, 429)"""
+
+
+class RemoteWriteShipper:
+    """Batches samples and ships them to a remote_write endpoint.
+
+    A background thread cuts a batch when it reaches ``batch_size`` samples or
+    ``flush_interval`` seconds have passed, then sends it with exponential
+    backoff. At most ``max_pending`` encoded batches are kept in memory; batches
+    that exhaust their retries, and the oldest pending batch when the queue
+    overflows, are written to ``spill_dir``.
+
+    Prometheus rejects samples older than what it already has for a series, so
+    batches must arrive in the order they were cut: spilled batches are always
+    older than in-memory ones and the spill is drained, oldest first, before
+    any pending batch is sent.
+    """
+
+    def __init__(self, url, batch_size=500, flush_interval=5.0, max_pending=16,
+                 max_retries=5, backoff_base=0.5, backoff_max=30.0, timeout=10.0,
+                 spill_dir=None, max_spill_bytes=64 * 1024 * 1024):
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.max_pending = max_pending
+
+        self._batch = []
+        self._batch_started = None
+        self._pending = collections.deque()  # (seq, payload), oldest first
+        self._inflight = None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        # Spill file names sort by (shipper start, batch seq), i.e. cut order,
+        # also across restarts
+        self._epoch = time.time_ns()
+        self._seq = 0
+        self.stats = collections.Counter()
+        self._stats_lock = threading.Lock()
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="remote-write", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Flush what is buffered and stop; unsent batches end up in the spill"""
+        with self._cond:
+            self._cut_batch()
+            self._stop.set()
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+        with self._cond:
+            # Older spilled data must go first; leave everything for the next run
+            ordered = not self._spill_files()
+            # If join() timed out the worker may still be sending the head
+            # batch; it stays in the queue for the worker to pop
+            inflight = self._inflight
+            for item in [i for i in self._pending if i is not inflight]:
+                self._pending.remove(item)
+                if inflight is not None or not ordered:
+                    self._spill(item)
+                    continue
+                try:
+                    self._send(item[1])
+                    self._count("sent_batches")
+                    self._count("sent_bytes", len(item[1]))
+                except (RecoverableError, urllib.error.HTTPError):
+                    self._spill(item)
+                    ordered = False
+
+    def add(self, samples):
+        with self._cond:
+            if not self._batch:
+                self._batch_started = time.monotonic()
+            self._batch.extend(samples)
+            self._count("samples_in", len(samples))
+            if len(self._batch) >= self.batch_size:
+                self._cut_batch()
+                self._cond.notify()
+
+    def _cut_batch(self):
+        """Encode the current batch into the pending queue (caller holds the lock)"""
+        while self._batch:
+            chunk, self._batch = self._batch[:self.batch_size], self._batch[self.batch_size:]
+            self._seq += 1
+            item = (self._seq, snappy_compress(encode_write_request(chunk)))
+            if len(self._pending) >= self.max_pending:
+                # Spill the oldest batch that is not being sent right now
+                victim = 1 if self._pending[0] is self._inflight else 0
+                if victim < len(self._pending):
+                    oldest = self._pending[victim]
+                    del self._pending[victim]
+                    self._spill(oldest)
+            self._pending.append(item)
+            self._count("batches")
+        self._batch_started = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                if self._batch_started is not None:
+                    due = self._batch_started + self.flush_interval - time.monotonic()
+                    if due <= 0:
+                        self._cut_batch()
+                else:
+                    due = self.flush_interval
+                if not self._pending and not self._spill_files() and not self._stop.is_set():
+                    self._cond.wait(max(due, 0.01))
+
+            # Older data first: nothing from memory goes out while the spill is non-empty
+            if not self._replay_spill():
+                continue
+
+            with self._cond:
+                item = self._inflight = self._pending[0] if self._pending else None
+            if item is None:
+                continue
+            sent = self._send_with_retry(item[1])
+            with self._cond:
+                self._inflight = None
+                if self._pending and self._pending[0] is item:
+                    self._pending.popleft()
+                    if not sent:
+                        self._spill(item)
+
+    def _send_with_retry(self, payload):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._send(payload)
+                self._count("sent_batches")
+                self._count("sent_bytes", len(payload))
+                return True
+            except RecoverableError as e:
+                self._count("retries")
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                delay *= random.uniform(0.5, 1.0)
+                logger.warning("remote_write failed (%s), retry in %.2fs", e, delay)
+                if self._stop.wait(delay):
+                    return False
+            except urllib.error.HTTPError as e:
+                # 4xx (except 429) will never succeed: drop like Prometheus does
+                self._count("dropped_batches")
+                logger.error("remote_write rejected batch: HTTP %s", e.code)
+                return True
+        return False
+
+    def _send(self, payload):
+        req = urllib.request.Request(self.url, data=payload, method="POST", headers={
+            "Content-Encoding": "snappy",
+            "Content-Type": "application/x-protobuf",
+            "User-Agent": "metrics-collector",
+            "X-Prometheus-Remote-Write-Version": "0.1.0",
+        })
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                resp.read()
+        except urllib.error.HTTPError as e:
+            if e.code >= 500 or e.code == 429:
+                raise RecoverableError(f"HTTP {e.code}") from e
+            raise
+        except (urllib.error.URLError, OSError) as e:
+            raise RecoverableError(str(e)) from e
+
+    # -- disk spill --
+
+    def _spill_files(self):
+        if not self.spill_dir:
+            return []
+        return sorted(f for f in os.listdir(self.spill_dir) if f.endswith(".rw"))
+
+    def _spill(self, item):
+        seq, payload = item
+        if not self.spill_dir:
+            self._count("dropped_batches")
+            return
+        name = f"{self._epoch:020d}-{seq:012d}.rw"
+        tmp = os.path.join(self.spill_dir, name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, os.path.join(self.spill_dir, name))
+        self._count("spilled_batches")
+        self._trim_spill()
+
+    def _trim_spill(self):
+        files = self._spill_files()
+        sizes = {f: os.path.getsize(os.path.join(self.spill_dir, f)) for f in files}
+        total = sum(sizes.values())
+        for f in files:
+            if total <= self.max_spill_bytes:
+                break
+            os.remove(os.path.join(self.spill_dir, f))
+            total -= sizes[f]
+            self._count("dropped_batches")
+
+    def _replay_spill(self):
+        """Send spilled batches oldest first; True once the spill is empty"""
+        while True:
+            with self._cond:
+                files = self._spill_files()
+            if not files:
+                return True
+            if self._stop.is_set():
+                return False
+            path = os.path.join(self.spill_dir, files[0])
+            try:
+                with open(path, "rb") as f:
+                    payload = f.read()
+            except FileNotFoundError:
+                continue  # trimmed by _trim_spill meanwhile
+            if not self._send_with_retry(payload):
+                return False
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._count("replayed_batches")
+
+
+# --- Stand-in receiver ------------------------------------------------------
+
+class _ReceiverHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            series = decode_write_request(snappy_decompress(body))
+        except Exception as e:  # malformed snappy or protobuf
+            self.send_error(400, f"bad payload: {e}")
+            return
+        samples = sum(len(points) for _, points in series)
+        stats = self.server.stats
+        with self.server.lock:
+            # Like Prometheus: reject samples older than the series' latest one
+            last_seen = self.server.last_seen
+            for labels, points in series:
+                key = tuple(sorted(labels.items()))
+                if any(ts < last_seen.get(key, ts) for _, ts in points):
+                    stats["out_of_order"] += 1
+                    self.send_error(400, f"out of order sample for {labels}")
+                    return
+            for labels, points in series:
+                key = tuple(sorted(labels.items()))
+                last_seen[key] = max([ts for _, ts in points] + [last_seen.get(key, 0)])
+            stats["requests"] += 1
+            stats["series"] += len(series)
+            stats["samples"] += samples
+            stats["bytes"] += len(body)
+        elapsed = time.monotonic() - self.server.started
+        logger.info("received %d series / %d samples (%d bytes); total %d samples, %.1f samples/s",
+                    len(series), samples, len(body), stats["samples"], stats["samples"] / elapsed)
+        if self.server.verbose:
+            for labels, points in series:
+                logger.info("  %s %s", labels, points)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def run_receiver(host, port, verbose=False):
+    server = ThreadingHTTPServer((host, port), _ReceiverHandler)
+    server.stats = collections.Counter()
+    server.lock = threading.Lock()
+    server.last_seen = {}
+    server.started = time.monotonic()
+    server.verbose = verbose
+    logger.info("remote_write receiver listening on http://%s:%d/api/v1/write", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info("receiver totals: %s", dict(server.stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="System metrics collector")
+    parser.add_argument("--remote-write", metavar="URL",
+                        help="push samples to a Prometheus remote_write endpoint")
+    parser.add_argument("--interval", type=float, default=15.0,
+                        help="collection interval in seconds")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="max samples per remote_write request")
+    parser.add_argument("--flush-interval", type=float, default=5.0,
+                        help="max seconds a sample waits before its batch is sent")
+    parser.add_argument("--max-pending", type=int, default=16,
+                        help="batches kept in memory before spilling to disk")
+    parser.add_argument("--spill-dir", help="directory for batches that could not be sent")
+    parser.add_argument("--job", default="metrics-collector")
+    parser.add_argument("--instance", default=socket.gethostname())
+    parser.add_argument("--receiver", action="store_true",
+                        help="run a stand-in remote_write receiver instead")
+    parser.add_argument("--host", default="127.0.0.1", help="receiver bind address")
+    parser.add_argument("--port", type=int, default=9201, help="receiver port")
+    parser.add_argument("--verbose", action="store_true", help="receiver: print every sample")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.receiver:
+        run_receiver(args.host, args.port, args.verbose)
+        return
+
+    if not args.remote_write:
+        metrics = collect_metrics()
+        print(json.dumps(metrics, indent=2))
+        return
+
+    shipper = RemoteWriteShipper(args.remote_write, batch_size=args.batch_size,
+                                 flush_interval=args.flush_interval,
+                                 max_pending=args.max_pending, spill_dir=args.spill_dir)
+    shipper.start()
+    try:
+        while True:
+            started = time.monotonic()
+            shipper.add(metrics_to_samples(collect_metrics(), args.job, args.instance))
+            time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shipper.stop(timeout=args.flush_interval + 5)
+        logger.info("shipper stats: %s", dict(shipper.stats))
+
+
 if __name__ == "__main__":
-    metrics = collect_metrics()
-    print(json.dumps(metrics, indent=2))
+    main()